@@ -1,142 +1,1129 @@
-from flask import Flask, jsonify, request, render_template, session, redirect, url_for
-from pymongo import MongoClient
+from flask import Flask, Blueprint, current_app, jsonify, request, render_template, session, redirect, url_for, g, has_request_context
+from pymongo import MongoClient, ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure, PyMongoError
 from bson.objectid import ObjectId
 import os
 import jwt
+import json
+import base64
 import datetime
+import threading
+import time
+import re
+import hashlib
+import logging
+from functools import wraps
+import math
 from dotenv import load_dotenv
+from werkzeug.middleware.proxy_fix import ProxyFix
+from jinja2 import FileSystemBytecodeCache
+from cache import LRUCache
+from revocation import RevocationStore
+from compression import Compressor
+from assets import StaticAssets
+from ratelimit import TokenBucketLimiter, MongoWindowLimiter, RateLimiter, InFlightGauge, parse_rate
+import serializer
+from metrics import Registry, Counter, Gauge, Histogram, CommandMetrics, PoolMetrics
+from slowlog import SlowQueryRecorder
+from coalesce import InsertCoalescer
 
 load_dotenv()  # Loads variables from .env into environment
 
-app = Flask(__name__)
+logger = logging.getLogger(__name__)
 
-app.secret_key = os.getenv("FLASK_SECRET_KEY", "fallback_dev_secret")
-jwt_secret = os.getenv("JWT_SECRET", "fallback_jwt_secret")
+bp = Blueprint('pseudojson', __name__, cli_group=None)
 
-mongo_uri = os.getenv("MONGO_URI")
-if not mongo_uri:
-    raise RuntimeError("MONGO_URI is not set. Create a .env file or export MONGO_URI.")
+compressor = Compressor(
+    min_size=int(os.getenv("COMPRESS_MIN_SIZE", "500")),
+    level=int(os.getenv("COMPRESS_LEVEL", "6")),
+    cache_size=int(os.getenv("COMPRESS_CACHE_SIZE", "512"))
+)
+static_assets = StaticAssets(max_age=int(os.getenv("STATIC_MAX_AGE", "31536000")))
 
-client = MongoClient(mongo_uri)
+# Connection state is filled in lazily by connect(), on first use or by the warm-up thread
+client = None
+db = None
+products = None
+raw_products = None
+meta = None
+connection_lock = threading.Lock()
 
+# Filled in by warm_up(); /readyz reports ready once all are true
+readiness = {'mongo': False, 'indexes': False, 'caches': False}
+warmup_started = threading.Event()
+# The app whose config the current connection came from
+connected_app = None
+# Set when warm-up hit an error that retrying can't fix
+warmup_error = None
 
+def current_route():
+    if not has_request_context():
+        return 'background'
+    return request.url_rule.rule if request.url_rule is not None else 'unmatched'
 
-# Database
-db = client.pseudojson
+metrics_registry = Registry()
+request_duration = metrics_registry.register(Histogram(
+    'http_request_duration_seconds', 'Request latency by route', labels=('method', 'route')
+))
+request_count = metrics_registry.register(Counter(
+    'http_requests_total', 'Requests by route and status', labels=('method', 'route', 'status')
+))
+command_metrics = CommandMetrics(metrics_registry, current_route)
+pool_metrics = PoolMetrics(metrics_registry)
+slow_queries = SlowQueryRecorder(
+    current_route,
+    threshold_ms=float(os.getenv("SLOW_QUERY_MS", "100")),
+    explain_rate=float(os.getenv("SLOW_QUERY_EXPLAIN_RATE", "0.1")),
+    size=int(os.getenv("SLOW_QUERY_RING_SIZE", "200")),
+    log_path=os.getenv("SLOW_QUERY_LOG")
+)
+# Optional group commit for POST /products: inserts arriving within the window share one insert_many
+insert_coalescer = InsertCoalescer(
+    metrics_registry,
+    window=float(os.getenv("INSERT_COALESCE_WINDOW_MS", "2")) / 1000,
+    max_batch=int(os.getenv("INSERT_COALESCE_MAX_BATCH", "64")),
+    # One generation bump per flushed batch instead of one per product
+    after_batch=lambda: bump_generation()
+) if os.getenv("INSERT_COALESCE", "0") == "1" else None
+# Optional bearer token required to scrape /metrics
+metrics_token = os.getenv("METRICS_TOKEN")
 
-# Collection
-products = db.products
+def mongo_client_options():
+    # Pool tuning; keep maxPoolSize at or above the worker's thread count
+    options = {
+        'event_listeners': [command_metrics, pool_metrics, slow_queries],
+        'maxPoolSize': int(os.getenv("MONGO_MAX_POOL_SIZE", "100")),
+        'minPoolSize': int(os.getenv("MONGO_MIN_POOL_SIZE", "0")),
+        'maxIdleTimeMS': int(os.getenv("MONGO_MAX_IDLE_TIME_MS", "60000")),
+        'serverSelectionTimeoutMS': int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "5000")),
+    }
+    if os.getenv("MONGO_WAIT_QUEUE_TIMEOUT_MS"):
+        options['waitQueueTimeoutMS'] = int(os.getenv("MONGO_WAIT_QUEUE_TIMEOUT_MS"))
+    return options
 
-blacklisted_tokens = set()
+def connect():
+    # Runs once per process (gunicorn workers reset after fork, see gunicorn.conf.py),
+    # so no MongoClient is ever shared across a fork
+    global client, db, products, raw_products, meta, connected_app
+    with connection_lock:
+        if client is not None:
+            if connected_app is not current_app._get_current_object():
+                # The connection, caches, limiters and readiness are module state
+                raise RuntimeError("This process is already connected for another app; "
+                                   "call reset_connection() before serving a different one.")
+            return client
+        mongo_client = current_app.config.get('MONGO_CLIENT')
+        if mongo_client is None:
+            mongo_uri = current_app.config.get('MONGO_URI')
+            if not mongo_uri:
+                raise RuntimeError("MONGO_URI is not set. Create a .env file or export MONGO_URI.")
+            mongo_client = MongoClient(mongo_uri, **mongo_client_options())
+
+        # Database
+        db = mongo_client.pseudojson
+
+        # Collection
+        products = db.products
+        # Read path: undecoded BSON that the serializer turns into JSON directly
+        raw_products = products.with_options(codec_options=serializer.RAW_CODEC_OPTIONS)
+        # Per-collection bookkeeping shared by all workers (write generation, last write time)
+        meta = db.meta
+
+        slow_queries.run_explain = explain_command
+        revocations.collection = db.revoked_tokens
+        revocations.counters = meta
+        if rate_limit_backend == 'mongo':
+            # A budget with rate 0 is disabled and gets no shared window
+            rate_limiter.shared = {
+                kind: MongoWindowLimiter(db.rate_limits, *rate_limits[kind])
+                for kind in rate_limits if rate_limits[kind][0] > 0
+            }
+        connected_app = current_app._get_current_object()
+        client = mongo_client
+        return client
+
+def explain_command(database_name, command):
+    return client[database_name].command('explain', command, verbosity='queryPlanner')
+
+def reset_connection():
+    # Forget a client inherited over fork without closing it; the parent still owns it
+    global client, connected_app, warmup_error
+    with connection_lock:
+        client = None
+        connected_app = None
+        warmup_error = None
+        clear_caches()
+        readiness.update(mongo=False, indexes=False, caches=False)
+        warmup_started.clear()
+
+# Shared across workers; entries expire with the token they revoke
+revocations = RevocationStore(
+    None, None,
+    sync_interval=float(os.getenv("REVOCATION_SYNC_INTERVAL", "1"))
+)
+
+# Fields a client may ask for with ?fields=
+product_fields = {
+    '_id', 'id', 'title', 'description', 'price', 'discountPercentage', 'rating',
+    'stock', 'brand', 'category', 'thumbnail', 'images'
+}
+# Sparse reads limited to these fields are answered from the index alone
+covering_index = [('id', 1), ('title', 1), ('price', 1), ('thumbnail', 1), ('_version', 1)]
+covered_fields = {name for name, _ in covering_index}
+# Indexes the /products query planner may rely on; created by ensure_indexes()
+query_indexes = [
+    [('id', 1)],
+    [('category_key', 1), ('id', 1)],
+    [('price', 1), ('id', 1)],
+    [('rating', 1), ('id', 1)],
+    [('category_key', 1), ('price', 1), ('id', 1)],
+    [('category_key', 1), ('rating', 1), ('id', 1)],
+    [('brand', 1), ('price', 1), ('id', 1)],
+]
+sortable_fields = {'id', 'price', 'rating'}
+# Collections at or below this size may be filtered/sorted without a supporting index
+planner_max_scan = int(os.getenv("PLANNER_MAX_SCAN", "10000"))
+
+# Per-client budgets as "rate/burst" in requests per second; 0 disables a budget
+rate_limits = {
+    'read': parse_rate(os.getenv("RATE_LIMIT_READ", "20/40")),
+    'write': parse_rate(os.getenv("RATE_LIMIT_WRITE", "5/10")),
+}
+# "mongo" also enforces the budgets across workers through the rate_limits collection
+rate_limit_backend = os.getenv("RATE_LIMIT_BACKEND", "local")
+rate_limiter = RateLimiter(
+    read=TokenBucketLimiter(*rate_limits['read']),
+    write=TokenBucketLimiter(*rate_limits['write'])
+)
+# Requests over this many in flight in one process get a 503; 0 disables shedding
+in_flight = InFlightGauge(int(os.getenv("LOAD_SHED_MAX_IN_FLIGHT", "64")))
+metrics_registry.register(Gauge('http_requests_in_flight', 'Requests being handled by this worker', lambda: in_flight.value))
+
+def ensure_indexes():
+    # Exact category lookups sorted by id, plus the filter/sort shapes the planner accepts
+    for keys in query_indexes[1:]:
+        products.create_index(keys)
+    products.create_index(covering_index)
+    # Relevance-ranked search over the fields people actually type queries about
+    products.create_index(
+        [('title', 'text'), ('brand', 'text'), ('description', 'text')],
+        weights={'title': 10, 'brand': 5, 'description': 1},
+        name='product_text'
+    )
+    revocations.ensure_indexes()
+    for limiter in rate_limiter.shared.values():
+        limiter.ensure_indexes()
+    # Backs every lookup by id and makes concurrent creates with the same id race-free.
+    # Built last: it fails while duplicate ids exist (see dedupe-product-ids)
+    products.create_index([('id', 1)], unique=True)
+
+# Serialized GET /products/<id> bodies
+product_cache = LRUCache(
+    maxsize=int(os.getenv("PRODUCT_CACHE_SIZE", "2048")),
+    ttl=float(os.getenv("PRODUCT_CACHE_TTL", "60"))
+)
+
+count_cache_ttl = float(os.getenv("COUNT_CACHE_TTL", "30"))
+count_cache_size = int(os.getenv("COUNT_CACHE_SIZE", "1024"))
+
+# Bumped by every write route; cached counts from an older generation are stale.
+# List routes resync it from the meta collection, the TTL bounds staleness elsewhere.
+catalog_generation = 0
+count_cache = {}
+count_cache_lock = threading.Lock()
+
+def clear_caches():
+    # Everything cached from the database the process was connected to
+    global catalog_generation, categories_cache
+    product_cache.clear()
+    facet_cache.clear()
+    with count_cache_lock:
+        count_cache.clear()
+        catalog_generation = 0
+        categories_cache = None
+
+def _set_generation(generation):
+    global catalog_generation
+    with count_cache_lock:
+        if generation != catalog_generation:
+            catalog_generation = generation
+            count_cache.clear()
+            # Another worker may have written; its invalidation never reached this cache
+            product_cache.clear()
+
+def bump_generation():
+    update = {'$inc': {'generation': 1}, '$set': {'updated_at': datetime.datetime.utcnow()}}
+    try:
+        doc = meta.find_one_and_update({'_id': 'products'}, update, upsert=True, return_document=ReturnDocument.AFTER)
+    except DuplicateKeyError:
+        # Two first-ever writes raced on the upsert; the document exists now
+        doc = meta.find_one_and_update({'_id': 'products'}, update, return_document=ReturnDocument.AFTER)
+    _set_generation(doc['generation'])
+
+# Id lookups never read the generation themselves; they re-check it at most this often
+generation_sync_interval = float(os.getenv("GENERATION_SYNC_INTERVAL", "1"))
+next_generation_sync = 0.0
+
+def recent_generation():
+    # Throttled sync_generation() for the product cache-hit paths, so another worker's
+    # write clears this worker's cached bodies within generation_sync_interval
+    if time.monotonic() >= next_generation_sync:
+        sync_generation()
+
+def sync_generation():
+    global next_generation_sync
+    next_generation_sync = time.monotonic() + generation_sync_interval
+    doc = meta.find_one({'_id': 'products'}) or {}
+    _set_generation(doc.get('generation', 0))
+    updated_at = doc.get('updated_at')
+    if updated_at:
+        updated_at = updated_at.replace(tzinfo=datetime.timezone.utc, microsecond=0)
+    return doc.get('generation', 0), updated_at
+
+def list_etag(generation, negotiated=False):
+    # Generation plus the exact request, so each page/filter gets its own validator.
+    # Routes that also serve NDJSON by Accept fold the media type in as well.
+    key = request.full_path
+    if negotiated and wants_ndjson():
+        key += ' ndjson'
+    digest = hashlib.blake2b(key.encode(), digest_size=8).hexdigest()
+    return f"g{generation}-{digest}"
+
+def negotiated(response):
+    # The same URL is JSON or NDJSON depending on Accept
+    response.vary.add('Accept')
+    return response
+
+def product_etag(product):
+    # _id tells a re-created product apart from the deleted one, whose _version restarted at 1
+    return f"p{product['id']}-{product['_id']}-v{product.get('_version', 0)}"
+
+def not_modified(etag, last_modified=None):
+    matched = None
+    if request.if_none_match:
+        # Compressed variants carry the encoding as an ETag suffix
+        for tag in (etag, f"{etag}-gzip", f"{etag}-deflate"):
+            if tag in request.if_none_match:
+                matched = tag
+                break
+    elif last_modified and request.if_modified_since:
+        if last_modified <= request.if_modified_since:
+            matched = etag
+    if not matched:
+        return None
+    response = current_app.response_class(status=304)
+    response.set_etag(matched)
+    response.vary.add('Accept-Encoding')
+    if last_modified:
+        response.last_modified = last_modified
+    return response
+
+def with_validators(response, etag, last_modified=None):
+    response.set_etag(etag)
+    if last_modified:
+        response.last_modified = last_modified
+    return response
+
+def _count_key(query):
+    return json.dumps(query, sort_keys=True, default=str)
+
+def get_cached_count(query):
+    key = _count_key(query)
+    with count_cache_lock:
+        entry = count_cache.get(key)
+        if entry and entry[0] == catalog_generation and entry[1] > time.monotonic():
+            return entry[2]
+    return None
+
+def set_cached_count(query, total, generation):
+    key = _count_key(query)
+    with count_cache_lock:
+        if generation != catalog_generation:
+            return
+        count_cache.pop(key, None)
+        if len(count_cache) >= count_cache_size:
+            count_cache.pop(next(iter(count_cache)))
+        count_cache[key] = (generation, time.monotonic() + count_cache_ttl, total)
+
+def count_products(query):
+    total = get_cached_count(query)
+    if total is None:
+        generation = catalog_generation
+        if query:
+            total = products.count_documents(query)
+        else:
+            # Collection metadata, no scan
+            total = products.estimated_document_count()
+        set_cached_count(query, total, generation)
+    return total
+
+def normalize_category(name):
+    return name.strip().lower()
+
+def set_category_key(doc):
+    if isinstance(doc.get('category'), str):
+        doc['category_key'] = normalize_category(doc['category'])
+
+categories_cache = None
+
+def list_categories():
+    global categories_cache
+    entry = categories_cache
+    if entry and entry[0] == catalog_generation and entry[1] > time.monotonic():
+        return entry[2]
+    generation = catalog_generation
+    # DISTINCT_SCAN over the category_key index
+    keys = sorted(k for k in products.distinct('category_key') if k)
+    categories_cache = (generation, time.monotonic() + count_cache_ttl, keys)
+    return keys
+
+def migrate_category_keys():
+    # Backfill category_key on documents written before it existed
+    result = products.update_many(
+        {'category': {'$type': 'string'}, 'category_key': {'$exists': False}},
+        [{'$set': {'category_key': {'$toLower': {'$trim': {'input': '$category'}}}}}]
+    )
+    bump_generation()
+    return result.modified_count
+
+@bp.cli.command('migrate-category-keys')
+def migrate_category_keys_command():
+    connect()
+    ensure_indexes()
+    print(f"Updated {migrate_category_keys()} products")
+
+def dedupe_product_ids():
+    # Duplicates left by racing creates before the unique index existed; per id, keep
+    # the highest _version (newest document on a tie) and delete the rest
+    groups = products.aggregate([
+        {'$group': {'_id': '$id', 'docs': {'$push': {'_id': '$_id', 'v': '$_version'}}, 'n': {'$sum': 1}}},
+        {'$match': {'n': {'$gt': 1}}}
+    ], allowDiskUse=True)
+    removed = 0
+    for group in groups:
+        keep = max(group['docs'], key=lambda doc: (doc.get('v') or 0, doc['_id']))
+        extra = [doc['_id'] for doc in group['docs'] if doc['_id'] != keep['_id']]
+        removed += products.delete_many({'_id': {'$in': extra}}).deleted_count
+        invalidate_product(group['_id'])
+    if removed:
+        bump_generation()
+    return removed
+
+@bp.cli.command('dedupe-product-ids')
+def dedupe_product_ids_command():
+    connect()
+    print(f"Removed {dedupe_product_ids()} duplicate products")
+    ensure_indexes()
+
+stream_batch_size = int(os.getenv("STREAM_BATCH_SIZE", "200"))
+
+def wants_ndjson():
+    best = request.accept_mimetypes.best_match(['application/json', 'application/x-ndjson'])
+    return best == 'application/x-ndjson'
+
+def wants_stream():
+    return request.args.get('stream') == '1' or wants_ndjson()
+
+def json_response(body, status=200):
+    return current_app.response_class(body, status=status, mimetype='application/json')
+
+def stream_products(cursor, envelope, limit, fields=None, keyset=False):
+    # Encode and send one product at a time instead of building the whole page first
+    ndjson = wants_ndjson()
+
+    def generate():
+        count = 0
+        last_id = None
+        if not ndjson:
+            yield b'{"products":['
+        for document in cursor.batch_size(stream_batch_size):
+            product = serializer.decode(document, fields)
+            last_id = product.get('id')
+            if ndjson:
+                yield serializer.dumps(product) + b'\n'
+            else:
+                yield (b',' if count else b'') + serializer.dumps(product)
+            count += 1
+        if not ndjson:
+            if keyset and limit and count == limit:
+                envelope['next'] = encode_cursor(last_id)
+            yield b'],' + serializer.dumps(envelope)[1:]
+
+    mimetype = 'application/x-ndjson' if ndjson else 'application/json'
+    response = current_app.response_class(generate(), mimetype=mimetype)
+    response.headers['X-Total-Count'] = str(envelope['total'])
+    return response
+
+def parse_fields():
+    raw = request.args.get('fields')
+    if not raw:
+        return None
+    fields = {name.strip() for name in raw.split(',') if name.strip()}
+    unknown = fields - product_fields
+    if unknown:
+        raise ValueError("Unknown field(s): " + ', '.join(sorted(unknown)))
+    # id is always returned, cursors and ETags depend on it
+    fields.add('id')
+    return tuple(sorted(fields))
+
+# Query parameter -> (field, operator, converter); operator None means equality
+product_filters = {
+    'category': ('category_key', None, normalize_category),
+    'brand': ('brand', None, str),
+    'price_gte': ('price', '$gte', float),
+    'price_lte': ('price', '$lte', float),
+    'rating_gte': ('rating', '$gte', float),
+}
+
+def parse_filters():
+    query = {}
+    for param, (field, op, convert) in product_filters.items():
+        raw = request.args.get(param)
+        if raw is None:
+            continue
+        try:
+            value = convert(raw.strip())
+        except ValueError:
+            raise ValueError(f"Invalid value for {param}")
+        if isinstance(value, float) and not math.isfinite(value):
+            raise ValueError(f"Invalid value for {param}")
+        if op is None:
+            query[field] = value
+        else:
+            query.setdefault(field, {})[op] = value
+    return query
+
+def parse_sort():
+    raw = request.args.get('sort')
+    if not raw:
+        return None
+    sort = []
+    for part in raw.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        direction = -1 if part.startswith('-') else 1
+        name = part.lstrip('+-')
+        if name not in sortable_fields:
+            raise ValueError(f"Cannot sort by {name}")
+        if any(name == field for field, _ in sort):
+            raise ValueError(f"Duplicate sort field {name}")
+        sort.append((name, direction))
+    if not sort:
+        return None
+    # id breaks ties so pages are stable
+    if all(field != 'id' for field, _ in sort):
+        sort.append(('id', sort[0][1]))
+    return sort
+
+def index_serves(keys, query, sort):
+    # Equality fields must form the index prefix, the sort must follow it in order
+    # (or exactly reversed) and every range field must be somewhere after the prefix
+    equality = {field for field, value in query.items() if not isinstance(value, dict)}
+    ranges = {field for field, value in query.items() if isinstance(value, dict)}
+    fields = [field for field, _ in keys]
+    if set(fields[:len(equality)]) != equality:
+        return False
+    rest = keys[len(equality):]
+    sort = [(field, direction) for field, direction in sort if field not in equality]
+    if len(sort) > len(rest):
+        return False
+    same = None
+    for (field, direction), (key_field, key_direction) in zip(sort, rest):
+        if field != key_field:
+            return False
+        if same is None:
+            same = direction == key_direction
+        elif same != (direction == key_direction):
+            return False
+    return ranges <= set(fields[len(equality):])
+
+def plan_query(query, sort):
+    # Returns the sort to use when an index serves query + sort without a collection
+    # scan or in-memory sort, else None. With no explicit sort, id order is preferred,
+    # then the order of whichever index serves the filter.
+    candidates = [sort] if sort else [[('id', 1)]] + [keys for keys in query_indexes]
+    for candidate in candidates:
+        if any(index_serves(keys, query, candidate) for keys in query_indexes):
+            if not sort:
+                equality = {field for field, value in query.items() if not isinstance(value, dict)}
+                candidate = [key for key in candidate if key[0] not in equality] or [('id', 1)]
+            return candidate
+    return None
+
+def fields_projection(fields, with_id=False):
+    if fields is None:
+        return None
+    projection = {name: 1 for name in fields}
+    projection['_version'] = 1
+    if '_id' not in fields and not with_id:
+        projection['_id'] = 0
+    return projection
+
+def find_products(query, fields, sort=None, with_id=False):
+    # with_id keeps _id for product ETags even when the fieldset leaves it out
+    cursor = raw_products.find(query, fields_projection(fields, with_id))
+    if sort:
+        cursor = cursor.sort(sort)
+    # Only worth forcing when filter and sort are on id alone; anything else would
+    # walk the whole index and sort in memory
+    if (fields is not None and not with_id and set(fields) <= covered_fields and set(query) <= {'id'}
+            and all(field == 'id' for field, _ in sort or ())):
+        cursor = cursor.hint(covering_index)
+    return cursor
+
+def load_product(id, fields=None):
+    # Cache-miss path of GET /products/<id>, also used to prewarm hot ids
+    generation = catalog_generation
+    product = next(find_products({'id': id}, fields, with_id=True).limit(1), None)
+    if not product:
+        return None
+    return cache_product(product, fields, generation)
+
+def load_products(ids, fields=None):
+    # Batch cache-miss path: one $in query for every id not already cached
+    generation = catalog_generation
+    entries = {}
+    for product in find_products({'id': {'$in': list(ids)}}, fields, with_id=True):
+        entries[product['id']] = cache_product(product, fields, generation)
+    return entries
+
+def cache_product(product, fields, generation):
+    etag = product_etag(product)
+    if fields is not None:
+        etag += '-' + hashlib.blake2b(','.join(fields).encode(), digest_size=4).hexdigest()
+    body = serializer.encode_product(product, fields)
+    # Skip caching if a write landed while we were reading
+    if generation == catalog_generation:
+        product_cache.set((product['id'], fields), (body, etag))
+    return body, etag
+
+def invalidate_product(id):
+    product_cache.invalidate_where(lambda key: key[0] == id)
+
+def find_page_with_count(query, sort, skip, limit, fields=None):
+    # Page and exact total in a single round trip, used when the count isn't cached
+    generation = catalog_generation
+    page = [{'$skip': skip}]
+    if limit:
+        page.append({'$limit': limit})
+    pipeline = [{'$match': query}]
+    if sort:
+        pipeline.append({'$sort': dict(sort)})
+    if fields is not None:
+        page.append({'$project': fields_projection(fields)})
+    pipeline.append({'$facet': {'data': page, 'total': [{'$count': 'n'}]}})
+    result = next(raw_products.aggregate(pipeline), {'data': [], 'total': []})
+    total = result['total'][0]['n'] if result['total'] else 0
+    set_cached_count(query, total, generation)
+    return result['data'], total
 
 def token_is_blacklisted(token):
-    return token in blacklisted_tokens
+    return revocations.is_revoked(token)
+
+# Claims of already-verified bearer tokens, each entry expires at the token's exp
+token_cache = LRUCache(maxsize=int(os.getenv("TOKEN_CACHE_SIZE", "1024")), ttl=0)
+
+def verify_token(token):
+    claims = token_cache.get(token)
+    if claims is None:
+        claims = jwt.decode(token, current_app.config['JWT_SECRET'], algorithms=['HS256'])
+        if 'exp' in claims:
+            token_cache.set(token, claims, ttl=claims['exp'] - time.time())
+    return claims
+
+def token_required(f):
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        auth_header = request.headers.get('Authorization')
+        if not auth_header or not auth_header.startswith('Bearer '):
+            return jsonify({"error": "Authorization header missing or invalid"}), 401
+
+        token = auth_header.split(' ')[1]
+        # Checked before the cache so a revoked token is rejected immediately
+        if token_is_blacklisted(token):
+            return jsonify({"error": "Token is blacklisted"}), 401
+
+        try:
+            g.token_claims = verify_token(token)
+        except jwt.ExpiredSignatureError:
+            return jsonify({"error": "Token expired"}), 401
+        except jwt.InvalidTokenError:
+            return jsonify({"error": "Invalid token"}), 401
+        return f(*args, **kwargs)
+    return decorated
+
+# Opaque keyset cursors: base64url of the last product id seen on a page
+def encode_cursor(last_id):
+    raw = json.dumps({'id': last_id}, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+def decode_cursor(cursor):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        return json.loads(base64.urlsafe_b64decode(padded))['id']
+    except (ValueError, TypeError, KeyError):
+        raise ValueError("Invalid cursor")
+
+def render_static_page(template):
+    # Pages that don't depend on the request are rendered once per worker
+    pages = current_app.extensions.setdefault('static_pages', {})
+    entry = pages.get(template)
+    if entry is None or current_app.jinja_env.auto_reload:
+        body = render_template(template)
+        entry = (body, 'h' + hashlib.blake2b(body.encode(), digest_size=8).hexdigest())
+        pages[template] = entry
+    body, etag = entry
+    return not_modified(etag) or with_validators(current_app.response_class(body, mimetype='text/html'), etag)
 
-@app.route('/', methods=['GET'])
+@bp.route('/', methods=['GET'])
 def home():
     # return render_template('index.html')
-    return render_template('home.html')
+    return render_static_page('home.html')
 
-@app.route('/dashboard')
+@bp.route('/dashboard')
 def dashboard():
     if not session.get('logged_in'):
-        return redirect(url_for('login'))
+        return redirect(url_for('.login'))
     token = session.get('token')
     return render_template('dashboard.html', token=token)
 
-@app.route('/products', methods=['GET'])
+@bp.route('/products', methods=['GET'])
 def get_products():
+    if 'ids' in request.args:
+        return get_products_by_ids()
     skip = int(request.args.get('skip', 0))
     limit = int(request.args.get('limit', 100))
+    after = request.args.get('after')
+    try:
+        fields = parse_fields()
+        query = parse_filters()
+        requested_sort = parse_sort()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
 
-    all_products = list(products.find().sort("id", 1).skip(skip).limit(limit))
-    for product in all_products:
-        product['_id'] = str(product['_id'])
-    total_count = products.count_documents({})
-    return jsonify({"products": all_products, "total": total_count})
+    sort = plan_query(query, requested_sort)
+    if sort is None:
+        if count_products({}) > planner_max_scan:
+            return jsonify({
+                "error": "This filter/sort combination is not indexed",
+                "indexed": [[field for field, _ in keys] for keys in query_indexes]
+            }), 400
+        sort = requested_sort or [('id', 1)]
+    keyset = len(sort) == 1 and sort[0][0] == 'id'
 
-@app.route('/products/<int:id>', methods=['GET'])
-def get_product(id):
-    product = products.find_one({'id': id})
-    if product:
-        product['_id'] = str(product['_id'])
-        return jsonify(product)
+    generation, last_modified = sync_generation()
+    etag = list_etag(generation, negotiated=True)
+    cached = not_modified(etag, last_modified)
+    if cached:
+        return negotiated(cached)
+
+    if after is not None:
+        # Keyset mode: seek on the id index instead of walking `skip` entries
+        if not keyset:
+            return jsonify({"error": "'after' is only supported when sorting by id"}), 400
+        try:
+            last_id = decode_cursor(after)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        page_query = dict(query, id={'$gt' if sort[0][1] == 1 else '$lt': last_id})
+        cursor = find_products(page_query, fields, sort).limit(limit)
     else:
-        return jsonify({"error": "Product not found"}), 404
+        cursor = find_products(query, fields, sort).skip(skip).limit(limit)
 
-@app.route('/products', methods=['POST'])
-def add_product():
-    auth_header = request.headers.get('Authorization')
-    if not auth_header or not auth_header.startswith('Bearer '):
-        return jsonify({"error": "Authorization header missing or invalid"}), 401
+    if wants_stream():
+        response = stream_products(cursor, {"total": count_products(query)}, limit, fields, keyset=keyset)
+        return negotiated(with_validators(response, etag, last_modified))
+
+    page, count, last_id = serializer.encode_page(cursor, fields)
+    extra = {"total": count_products(query)}
+    if keyset and limit and count == limit:
+        extra["next"] = encode_cursor(last_id)
+    response = json_response(serializer.encode_envelope(page, **extra))
+    return negotiated(with_validators(response, etag, last_modified))
+
+batch_max_ids = int(os.getenv("BATCH_MAX_IDS", "100"))
+
+def get_products_by_ids():
+    try:
+        ids = [int(part) for part in request.args['ids'].split(',') if part.strip()]
+    except ValueError:
+        return jsonify({"error": "ids must be a comma-separated list of integers"}), 400
+    try:
+        fields = parse_fields()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    ids = list(dict.fromkeys(ids))
+    if not ids:
+        return jsonify({"error": "ids must not be empty"}), 400
+    if len(ids) > batch_max_ids:
+        return jsonify({"error": f"At most {batch_max_ids} ids per request"}), 400
+
+    recent_generation()
+    entries = {}
+    for id in ids:
+        entry = product_cache.get((id, fields))
+        if entry is not None:
+            entries[id] = entry
+    uncached = [id for id in ids if id not in entries]
+    if uncached:
+        entries.update(load_products(uncached, fields))
 
-    token = auth_header.split(' ')[1]
-    if token_is_blacklisted(token):
-        return jsonify({"error": "Token is blacklisted"}), 401
+    # Results in request order; ids with no product are listed instead
+    found = [entries[id] for id in ids if id in entries]
+    missing = [id for id in ids if id not in entries]
+    digest = hashlib.blake2b(digest_size=8)
+    for _, product_tag in found:
+        digest.update(product_tag.encode() + b',')
+    digest.update(repr(missing).encode())
+    etag = 'b' + digest.hexdigest()
+    cached = not_modified(etag)
+    if cached:
+        return cached
+    page = b'[' + b','.join(body for body, _ in found) + b']'
+    return with_validators(json_response(serializer.encode_envelope(page, missing=missing)), etag)
 
+@bp.route('/products/<int:id>', methods=['GET'])
+def get_product(id):
     try:
-        jwt.decode(token, jwt_secret, algorithms=['HS256'])
-    except jwt.ExpiredSignatureError:
-        return jsonify({"error": "Token expired"}), 401
-    except jwt.InvalidTokenError:
-        return jsonify({"error": "Invalid token"}), 401
+        fields = parse_fields()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    recent_generation()
+    entry = product_cache.get((id, fields))
+    if entry is not None:
+        body, etag = entry
+        return not_modified(etag) or with_validators(json_response(body), etag)
 
+    entry = load_product(id, fields)
+    if entry:
+        body, etag = entry
+        return not_modified(etag) or with_validators(json_response(body), etag)
+    else:
+        return jsonify({"error": "Product not found"}), 404
+
+@bp.route('/products', methods=['POST'])
+@token_required
+def add_product():
     product = request.json
     if not product.get('id'):
         return jsonify({"error": "ID is required"}), 400
-    if products.find_one({'id': product['id']}):
+    set_category_key(product)
+    product['_version'] = 1
+    try:
+        if insert_coalescer:
+            # The batch leader bumps the generation once the batch is written
+            inserted_id = insert_coalescer.insert(products, product)
+        else:
+            inserted_id = products.insert_one(product).inserted_id
+            bump_generation()
+    except DuplicateKeyError:
         return jsonify({"error": "Product with this ID already exists"}), 409
-    result = products.insert_one(product)
-    product['_id'] = str(result.inserted_id)
-    return jsonify(product), 201
+    invalidate_product(product['id'])
+    product['_id'] = str(inserted_id)
+    return jsonify(serializer.strip_internal(product)), 201
+
+def changed_filter(id, update_data):
+    # Match only when some field actually changes, so a no-op update neither bumps
+    # _version nor invalidates anything
+    return {'id': id, '$or': [{field: {'$ne': value}} for field, value in update_data.items()]}
 
-@app.route('/products/<int:id>', methods=['PUT'])
+@bp.route('/products/<int:id>', methods=['PUT'])
 def update_product(id):
     update_data = request.json
-    result = products.update_one({'id': id}, {'$set': update_data})
+    update_data.pop('_version', None)
+    set_category_key(update_data)
+    if not update_data:
+        return jsonify({"error": "Product not updated"}), 404
+    result = products.update_one(changed_filter(id, update_data), {'$set': update_data, '$inc': {'_version': 1}})
     if result.modified_count:
+        bump_generation()
+        invalidate_product(id)
         return jsonify({"id": id})
     else:
         return jsonify({"error": "Product not updated"}), 404
 
-@app.route('/products/<int:id>', methods=['DELETE'])
+@bp.route('/products/<int:id>', methods=['DELETE'])
+@token_required
 def delete_product(id):
-    auth_header = request.headers.get('Authorization')
-    if not auth_header or not auth_header.startswith('Bearer '):
-        return jsonify({"error": "Authorization header missing or invalid"}), 401
-
-    token = auth_header.split(' ')[1]
-    if token_is_blacklisted(token):
-        return jsonify({"error": "Token is blacklisted"}), 401
-
-    try:
-        jwt.decode(token, jwt_secret, algorithms=['HS256'])
-    except jwt.ExpiredSignatureError:
-        return jsonify({"error": "Token expired"}), 401
-    except jwt.InvalidTokenError:
-        return jsonify({"error": "Invalid token"}), 401
-
     result = products.delete_one({'id': id})
     if result.deleted_count:
+        bump_generation()
+        invalidate_product(id)
         return jsonify({"id": id})
     else:
         return jsonify({"error": "Product not found"}), 404
 
-@app.route('/products/category/<category_name>', methods=['GET'])
+bulk_batch_size = int(os.getenv("BULK_BATCH_SIZE", "1000"))
+
+def valid_bulk_id(value):
+    return bool(value) and isinstance(value, (int, str)) and not isinstance(value, bool)
+
+def chunked(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+def bulk_insert(items):
+    results = [None] * len(items)
+    pending = []
+    seen = set()
+    for index, product in enumerate(items):
+        if not isinstance(product, dict) or not valid_bulk_id(product.get('id')):
+            results[index] = {"index": index, "status": "invalid", "error": "ID is required"}
+        elif product['id'] in seen:
+            results[index] = {"index": index, "id": product['id'], "status": "conflict"}
+        else:
+            seen.add(product['id'])
+            set_category_key(product)
+            product['_version'] = 1
+            pending.append((index, product))
+
+    for batch in chunked(pending, bulk_batch_size):
+        # Ids already in the collection come back as duplicate key write errors
+        failed = {}
+        try:
+            products.insert_many([product for _, product in batch], ordered=False)
+        except BulkWriteError as e:
+            failed = {error['index']: error for error in e.details['writeErrors']}
+        for position, (index, product) in enumerate(batch):
+            error = failed.get(position)
+            if error is None:
+                results[index] = {"index": index, "id": product['id'], "status": "created"}
+            elif error['code'] == 11000:
+                results[index] = {"index": index, "id": product['id'], "status": "conflict"}
+            else:
+                results[index] = {"index": index, "id": product['id'], "status": "error", "error": error['errmsg']}
+    return results
+
+def bulk_update(items):
+    results = [None] * len(items)
+    pending = []
+    for index, update_data in enumerate(items):
+        if not isinstance(update_data, dict) or not valid_bulk_id(update_data.get('id')):
+            results[index] = {"index": index, "status": "invalid", "error": "ID is required"}
+        else:
+            update_data.pop('_version', None)
+            set_category_key(update_data)
+            pending.append((index, update_data))
+
+    for batch in chunked(pending, bulk_batch_size):
+        names = {'id'} | {field.split('.')[0] for _, update_data in batch for field in update_data}
+        existing = {doc['id']: doc for doc in products.find(
+            {'id': {'$in': [update_data['id'] for _, update_data in batch]}},
+            dict({name: 1 for name in names}, _id=0))}
+        operations = []
+        updated = []
+        for index, update_data in batch:
+            doc = existing.get(update_data['id'])
+            if doc is None:
+                results[index] = {"index": index, "id": update_data['id'], "status": "not_found"}
+            elif not any(field_value(doc, field) != value for field, value in update_data.items()):
+                # Same answer a no-op single PUT gets
+                results[index] = {"index": index, "id": update_data['id'], "status": "not_updated"}
+            else:
+                operations.append(UpdateOne(changed_filter(update_data['id'], update_data),
+                                            {'$set': update_data, '$inc': {'_version': 1}}))
+                results[index] = {"index": index, "id": update_data['id'], "status": "updated"}
+                updated.append(index)
+        if operations and not products.bulk_write(operations, ordered=False).modified_count:
+            # Concurrent writers got there first; nothing changed after all
+            for index in updated:
+                results[index]['status'] = 'not_updated'
+    return results
+
+def field_value(doc, path):
+    for name in path.split('.'):
+        if not isinstance(doc, dict):
+            return None
+        doc = doc.get(name)
+    return doc
+
+def bulk_delete(ids):
+    results = [None] * len(ids)
+    pending = []
+    for index, id in enumerate(ids):
+        if not valid_bulk_id(id):
+            results[index] = {"index": index, "status": "invalid", "error": "ID is required"}
+        else:
+            pending.append((index, id))
+
+    for batch in chunked(pending, bulk_batch_size):
+        batch_ids = [id for _, id in batch]
+        existing = {doc['id'] for doc in products.find({'id': {'$in': batch_ids}}, {'id': 1, '_id': 0})}
+        if existing:
+            products.delete_many({'id': {'$in': list(existing)}})
+        for index, id in batch:
+            results[index] = {"index": index, "id": id, "status": "deleted" if id in existing else "not_found"}
+    return results
+
+@bp.route('/products/bulk', methods=['POST', 'PUT', 'DELETE'])
+@token_required
+def bulk_products():
+    items = request.get_json(silent=True)
+    if not isinstance(items, list):
+        return jsonify({"error": "Request body must be a JSON array"}), 400
+
+    if request.method == 'POST':
+        results = bulk_insert(items)
+    elif request.method == 'PUT':
+        results = bulk_update(items)
+    else:
+        results = bulk_delete(items)
+
+    touched = [result['id'] for result in results if result['status'] in ('created', 'updated', 'deleted')]
+    if touched:
+        bump_generation()
+        if len(touched) > product_cache.maxsize:
+            product_cache.clear()
+        else:
+            touched = set(touched)
+            product_cache.invalidate_where(lambda key: key[0] in touched)
+
+    summary = {}
+    for result in results:
+        summary[result['status']] = summary.get(result['status'], 0) + 1
+    return jsonify({"results": results, "summary": summary})
+
+search_max_query_length = int(os.getenv("SEARCH_MAX_QUERY_LENGTH", "200"))
+
+@bp.route('/products/search', methods=['GET'])
+def search_products():
+    q = request.args.get('q', '').strip()
+    skip = int(request.args.get('skip', 0))
+    limit = int(request.args.get('limit', 100))
+    if not q:
+        return jsonify({"error": "Query parameter 'q' is required"}), 400
+    if len(q) > search_max_query_length:
+        return jsonify({"error": "Search query is too long"}), 400
+    try:
+        fields = parse_fields()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    generation, last_modified = sync_generation()
+    etag = list_etag(generation)
+    cached = not_modified(etag, last_modified)
+    if cached:
+        return cached
+
+    # The text index returns only matching documents, so cost follows the match count
+    query = {'$text': {'$search': q}}
+    projection = fields_projection(fields) or {}
+    projection['score'] = {'$meta': 'textScore'}
+    cursor = raw_products.find(query, projection).sort([('score', {'$meta': 'textScore'})]).skip(skip).limit(limit)
+    page, _, _ = serializer.encode_page(cursor, fields)
+    body = serializer.encode_envelope(page, total=count_products(query), q=q)
+    return with_validators(json_response(body), etag, last_modified)
+
+facet_price_boundaries = [float(b) for b in os.getenv("FACET_PRICE_BOUNDARIES", "0,10,25,50,100,250,500,1000,2500").split(',')]
+# Serialized facet bodies keyed by (generation, filter); a write bumps the generation
+facet_cache = LRUCache(maxsize=int(os.getenv("FACET_CACHE_SIZE", "256")), ttl=count_cache_ttl)
+
+def compute_facets(query):
+    # Every facet from one pass over the matching documents
+    pipeline = [
+        {'$match': query},
+        {'$facet': {
+            'total': [{'$count': 'count'}],
+            'categories': [
+                {'$group': {'_id': '$category_key', 'count': {'$sum': 1}}},
+                {'$sort': {'count': -1, '_id': 1}}
+            ],
+            'price': [
+                {'$match': {'price': {'$type': 'number'}}},
+                {'$group': {'_id': None, 'min': {'$min': '$price'}, 'max': {'$max': '$price'}, 'avg': {'$avg': '$price'}}}
+            ],
+            'price_buckets': [
+                {'$bucket': {'groupBy': '$price', 'boundaries': facet_price_boundaries, 'default': 'other',
+                             'output': {'count': {'$sum': 1}}}}
+            ],
+            'rating': [
+                {'$match': {'rating': {'$type': 'number'}}},
+                {'$group': {'_id': {'$floor': '$rating'}, 'count': {'$sum': 1}}},
+                {'$sort': {'_id': 1}}
+            ]
+        }}
+    ]
+    result = next(products.aggregate(pipeline), {})
+    total = result.get('total') or [{'count': 0}]
+    price = (result.get('price') or [None])[0]
+    upper = dict(zip(facet_price_boundaries, facet_price_boundaries[1:]))
+    buckets = []
+    for bucket in result.get('price_buckets', []):
+        if bucket['_id'] == 'other':
+            buckets.append({'min': None, 'max': None, 'count': bucket['count']})
+        else:
+            buckets.append({'min': bucket['_id'], 'max': upper[bucket['_id']], 'count': bucket['count']})
+    return {
+        'total': total[0]['count'],
+        'categories': [{'category': c['_id'], 'count': c['count']} for c in result.get('categories', []) if c['_id']],
+        'price': {'min': price['min'], 'max': price['max'], 'avg': price['avg']} if price else None,
+        'price_buckets': buckets,
+        'rating': [{'rating': int(r['_id']), 'count': r['count']} for r in result.get('rating', [])]
+    }
+
+@bp.route('/products/facets', methods=['GET'])
+def get_facets():
+    try:
+        query = parse_filters()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    generation, last_modified = sync_generation()
+    etag = list_etag(generation)
+    cached = not_modified(etag, last_modified)
+    if cached:
+        return cached
+
+    key = (generation, json.dumps(query, sort_keys=True))
+    body = facet_cache.get(key)
+    if body is None:
+        body = serializer.dumps(compute_facets(query))
+        facet_cache.set(key, body)
+    return with_validators(json_response(body), etag, last_modified)
+
+@bp.route('/products/categories', methods=['GET'])
+def get_categories():
+    return jsonify({'categories': list_categories()})
+
+@bp.route('/products/category/<category_name>', methods=['GET'])
 def get_products_by_category(category_name):
     skip = int(request.args.get('skip', 0))
     limit = int(request.args.get('limit', 100))
+    try:
+        fields = parse_fields()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    generation, last_modified = sync_generation()
+    etag = list_etag(generation, negotiated=True)
+    cached = not_modified(etag, last_modified)
+    if cached:
+        return negotiated(cached)
 
-    category_products = products.find({'category': {'$regex': category_name, '$options': 'i'}}).skip(skip).limit(limit)
-    result = []
-    for product in category_products:
-        product['_id'] = str(product['_id'])
-        result.append(product)
+    key = normalize_category(category_name)
+    if request.args.get('match') == 'contains':
+        # Opt-in substring match; the input is escaped so it is never run as a pattern
+        query = {'category_key': {'$regex': re.escape(key)}}
+    else:
+        query = {'category_key': key}
+    sort = [('id', 1)]
+    if wants_stream():
+        cursor = find_products(query, fields, sort).skip(skip).limit(limit)
+        envelope = {'total': count_products(query), 'category': category_name}
+        return negotiated(with_validators(stream_products(cursor, envelope, limit, fields), etag, last_modified))
 
-    total_count = products.count_documents({'category': {'$regex': category_name, '$options': 'i'}})
-    return jsonify({'products': result, 'total': total_count, 'category': category_name})
+    total_count = get_cached_count(query)
+    if total_count is None:
+        category_products, total_count = find_page_with_count(query, sort, skip, limit, fields)
+    else:
+        category_products = find_products(query, fields, sort).skip(skip).limit(limit)
+    page, _, _ = serializer.encode_page(category_products, fields)
+    body = serializer.encode_envelope(page, total=total_count, category=category_name)
+    return negotiated(with_validators(json_response(body), etag, last_modified))
 
-@app.route('/login', methods=['GET', 'POST'])
+@bp.route('/login', methods=['GET', 'POST'])
 def login():
     if request.method == 'POST':
         username = request.form['username']
@@ -145,7 +1132,7 @@ def login():
             token = jwt.encode({
                 'user': username,
                 'exp': datetime.datetime.utcnow() + datetime.timedelta(hours=1)
-            }, jwt_secret, algorithm='HS256')
+            }, current_app.config['JWT_SECRET'], algorithm='HS256')
             session['logged_in'] = True
             session['token'] = token
             return jsonify({"token": token})
@@ -153,45 +1140,212 @@ def login():
             return jsonify({"error": "Invalid credentials"}), 401
     return render_template('login.html')
 
-@app.route('/logout')
+@bp.route('/logout')
 def logout():
     token = session.pop('token', None)
     session.pop('logged_in', None)
     if token:
-        blacklisted_tokens.add(token)
-    return redirect(url_for('home'))
+        try:
+            claims = jwt.decode(token, current_app.config['JWT_SECRET'], algorithms=['HS256'])
+        except jwt.InvalidTokenError:
+            # Already expired or not ours, nothing left to revoke
+            claims = None
+        if claims and 'exp' in claims:
+            revocations.revoke(token, claims['exp'])
+        token_cache.invalidate(token)
+    return redirect(url_for('.home'))
 
-@app.route('/api/check_token', methods=['GET'])
+@bp.route('/api/check_token', methods=['GET'])
+@token_required
 def check_token():
-    auth_header = request.headers.get('Authorization')
-    if not auth_header or not auth_header.startswith('Bearer '):
-        return jsonify({"error": "Authorization header missing or invalid"}), 401
+    return jsonify({"message": "Token is valid"})
 
-    token = auth_header.split(' ')[1]
-    if token_is_blacklisted(token):
-        return jsonify({"error": "Token is blacklisted"}), 401
+@bp.route('/api/slow_queries', methods=['GET'])
+@token_required
+def get_slow_queries():
+    limit = int(request.args.get('limit', 50))
+    return jsonify({"threshold_ms": slow_queries.threshold_ms, "queries": slow_queries.recent(limit)})
 
-    try:
-        jwt.decode(token, jwt_secret, algorithms=['HS256'])
-        return jsonify({"message": "Token is valid"})
-    except jwt.ExpiredSignatureError:
-        return jsonify({"error": "Token expired"}), 401
-    except jwt.InvalidTokenError:
-        return jsonify({"error": "Invalid token"}), 401
-
-@app.route('/manage_products')
+@bp.route('/api/cache_stats', methods=['GET'])
+def cache_stats():
+    return jsonify({"product_cache": product_cache.stats(), "token_cache": token_cache.stats(), "facet_cache": facet_cache.stats()})
+
+@bp.route('/manage_products')
 def add_product_page():
     if not session.get('logged_in'):
-        return redirect(url_for('login'))
+        return redirect(url_for('.login'))
     token = session.get('token')
     return render_template('manage_products.html', token=token)
 
-@app.route('/delete_product')
+@bp.route('/delete_product')
 def delete_product_page():
     if not session.get('logged_in'):
-        return redirect(url_for('login'))
+        return redirect(url_for('.login'))
     token = session.get('token')
     return render_template('delete_product.html', token=token)
 
+@bp.route('/metrics', methods=['GET'])
+def metrics():
+    if metrics_token and request.headers.get('Authorization') != f'Bearer {metrics_token}':
+        return jsonify({"error": "Authorization header missing or invalid"}), 401
+    return current_app.response_class(metrics_registry.render(), mimetype='text/plain; version=0.0.4')
+
+def start_request_timer():
+    g.request_start = time.perf_counter()
+
+def record_request_metrics(response):
+    start = g.pop('request_start', None)
+    if start is not None:
+        route = current_route()
+        request_duration.observe(time.perf_counter() - start, request.method, route)
+        request_count.inc(request.method, route, str(response.status_code))
+    return response
+
+@bp.route('/healthz', methods=['GET'])
+def healthz():
+    return jsonify({"status": "ok"})
+
+@bp.route('/readyz', methods=['GET'])
+def readyz():
+    start_warmup(current_app._get_current_object())
+    checks = dict(readiness)
+    if checks['mongo']:
+        try:
+            client.admin.command('ping')
+        except PyMongoError:
+            checks['mongo'] = False
+    status = 200 if all(checks.values()) else 503
+    if warmup_error:
+        return jsonify({"status": "failed", "checks": checks, "error": warmup_error}), status
+    return jsonify({"status": "ready" if status == 200 else "starting", "checks": checks}), status
+
+def warm_up(app):
+    # Connect, build indexes and fill the caches off the request path
+    global warmup_error
+    delay = 0.5
+    with app.app_context():
+        while True:
+            try:
+                connect()
+                client.admin.command('ping')
+                readiness['mongo'] = True
+                ensure_indexes()
+                readiness['indexes'] = True
+                sync_generation()
+                count_products({})
+                list_categories()
+                revocations.sync()
+                for id in app.config['WARM_PRODUCT_IDS']:
+                    load_product(id)
+                readiness['caches'] = True
+                return
+            except RuntimeError:
+                logger.exception("Warm-up aborted")
+                return
+            except OperationFailure as e:
+                # The server refused the command; retrying won't change its answer
+                if e.code == 11000:
+                    logger.error("Unique index on products.id cannot be built while duplicate ids exist; "
+                                 "run `flask --app app dedupe-product-ids` and restart")
+                else:
+                    logger.exception("Warm-up aborted")
+                warmup_error = str(e)
+                return
+            except PyMongoError:
+                logger.warning("Warm-up failed, retrying in %.1fs", delay, exc_info=True)
+                time.sleep(delay)
+                delay = min(delay * 2, 30)
+
+def start_warmup(app):
+    if not warmup_started.is_set():
+        warmup_started.set()
+        threading.Thread(target=warm_up, args=(app,), name='warmup', daemon=True).start()
+
+def rate_limit_key():
+    # Only a verified token earns its own budget; an arbitrary bearer string would let a
+    # client mint a fresh bucket per request
+    auth_header = request.headers.get('Authorization', '')
+    if auth_header.startswith('Bearer '):
+        token = auth_header[7:]
+        try:
+            if not token_is_blacklisted(token):
+                verify_token(token)
+                return 'token:' + hashlib.sha256(token.encode()).hexdigest()[:32]
+        except (jwt.InvalidTokenError, PyMongoError):
+            # Unverifiable right now (bad token, or the revocation sync failed)
+            pass
+    return 'ip:' + (request.remote_addr or '')
+
+def too_busy(status, error, retry_after):
+    response = jsonify({"error": error})
+    response.status_code = status
+    response.headers['Retry-After'] = str(max(1, math.ceil(retry_after)))
+    return response
+
+@bp.before_app_request
+def before_request():
+    if request.endpoint in ('pseudojson.healthz', 'pseudojson.readyz', 'pseudojson.metrics', 'static'):
+        return
+    # Connecting is lazy and cheap; the revocation store and shared limiters need it
+    start_warmup(current_app._get_current_object())
+    if client is None:
+        connect()
+
+    kind = 'read' if request.method in ('GET', 'HEAD') else 'write'
+    if rate_limits[kind][0] > 0:
+        retry_after = rate_limiter.hit(kind, rate_limit_key())
+        if retry_after:
+            return too_busy(429, "Too many requests", retry_after)
+    if not in_flight.acquire():
+        return too_busy(503, "Server is busy, try again shortly", 1)
+    g.in_flight = True
+
+@bp.after_app_request
+def hold_slot_while_streaming(response):
+    # A streamed body is produced after teardown; keep the slot until it is closed
+    if response.is_streamed and g.pop('in_flight', False):
+        response.call_on_close(in_flight.release)
+    return response
+
+@bp.teardown_app_request
+def teardown_request(exc):
+    if g.pop('in_flight', False):
+        in_flight.release()
+
+def create_app(config=None):
+    # Config is read when the process connects. The connection, caches, limiters and
+    # readiness are module state, so a process serves one connected app at a time.
+    app = Flask(__name__)
+    app.config.update(
+        SECRET_KEY=os.getenv("FLASK_SECRET_KEY", "fallback_dev_secret"),
+        JWT_SECRET=os.getenv("JWT_SECRET", "fallback_jwt_secret"),
+        MONGO_URI=os.getenv("MONGO_URI"),
+        # Pass a ready client (or a local stand-in) instead of a URI
+        MONGO_CLIENT=None,
+        WARM_PRODUCT_IDS=[int(id) for id in os.getenv("WARM_PRODUCT_IDS", "").split(',') if id.strip()],
+        # Number of proxies in front of the app (1 on Heroku) so rate limits see real client IPs
+        PROXY_FIX_X_FOR=int(os.getenv("PROXY_FIX_X_FOR", "0")),
+        # Compiled templates survive restarts. Without a directory Jinja uses a private
+        # per-user one it creates with mode 0700 and checks ownership of
+        JINJA_BYTECODE_CACHE=os.getenv("JINJA_BYTECODE_CACHE", "1") == "1",
+        JINJA_BYTECODE_CACHE_DIR=os.getenv("JINJA_BYTECODE_CACHE_DIR") or None,
+    )
+    app.config.update(config or {})
+    if app.config['JINJA_BYTECODE_CACHE']:
+        app.jinja_env.bytecode_cache = FileSystemBytecodeCache(app.config['JINJA_BYTECODE_CACHE_DIR'])
+    if app.config['PROXY_FIX_X_FOR']:
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['PROXY_FIX_X_FOR'])
+    app.before_request(start_request_timer)
+    app.after_request(record_request_metrics)
+    app.register_blueprint(bp)
+    app.url_defaults(static_assets.url_defaults)
+    app.after_request(static_assets.after_request)
+    app.after_request(compressor.after_request)
+    return app
+
+# No connection is made here; it happens on the first request or in the warm-up thread
+app = create_app()
+
 if __name__ == '__main__':
+    start_warmup(app)
     app.run(debug=True)
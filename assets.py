@@ -0,0 +1,48 @@
+import hashlib
+import os
+import threading
+
+from flask import current_app, request
+
+
+class StaticAssets:
+    # Content-hashed static URLs: url_for('static', ...) gets a ?v=<digest> of the
+    # file, and a request carrying the current digest is served as immutable so
+    # browsers never revalidate it. A deploy that changes the file changes the URL.
+
+    def __init__(self, max_age=31536000):
+        self.max_age = max_age
+        self._digests = {}
+        self._lock = threading.Lock()
+
+    def fingerprint(self, filename):
+        path = os.path.join(current_app.static_folder, filename)
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            return None
+        entry = self._digests.get(path)
+        if entry and entry[0] == mtime:
+            return entry[1]
+        with open(path, 'rb') as f:
+            digest = hashlib.blake2b(f.read(), digest_size=6).hexdigest()
+        with self._lock:
+            self._digests[path] = (mtime, digest)
+        return digest
+
+    def url_defaults(self, endpoint, values):
+        if endpoint == 'static' and 'filename' in values and 'v' not in values:
+            digest = self.fingerprint(values['filename'])
+            if digest:
+                values['v'] = digest
+
+    def after_request(self, response):
+        if request.endpoint != 'static' or response.status_code not in (200, 304):
+            return response
+        version = request.args.get('v')
+        if version and version == self.fingerprint(request.view_args['filename']):
+            response.cache_control.no_cache = None
+            response.cache_control.public = True
+            response.cache_control.max_age = self.max_age
+            response.cache_control.immutable = True
+        return response
@@ -0,0 +1,314 @@
+# Load test every route of the app and write a machine-readable report.
+#
+#   pip install -r benchmarks/requirements.txt
+#   python -m benchmarks.load --products 10000 --output bench.json
+#   python -m benchmarks.load --baseline bench.json      # compare against an older run
+#
+# The app runs under gunicorn with gunicorn.conf.py against an in-memory stand-in
+# seeded before fork (or a throwaway real server via --mongo-uri --seed).
+import argparse
+import http.client
+import itertools
+import json
+import os
+import random
+import signal
+import subprocess
+import sys
+import threading
+import time
+import urllib.parse
+
+from benchmarks import standin
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class Server:
+    def __init__(self, args):
+        env = dict(os.environ)
+        env.update({
+            'PORT': str(args.port),
+            'WEB_CONCURRENCY': str(args.workers),
+            'GUNICORN_THREADS': str(args.threads),
+            'GUNICORN_ACCESS_LOG': '',
+            'BENCH_PRODUCTS': str(args.products),
+            # Measure the app, not the limiter
+            'RATE_LIMIT_READ': '0',
+            'RATE_LIMIT_WRITE': '0',
+            'LOAD_SHED_MAX_IN_FLIGHT': '0',
+        })
+        if args.mongo_uri:
+            env['BENCH_MONGO_URI'] = args.mongo_uri
+        self.process = subprocess.Popen(
+            [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'benchmarks.server:app'],
+            cwd=ROOT, env=env
+        )
+
+    def worker_pids(self):
+        pids = []
+        for entry in os.listdir('/proc'):
+            if not entry.isdigit():
+                continue
+            try:
+                with open(f'/proc/{entry}/stat') as f:
+                    ppid = int(f.read().rsplit(')', 1)[1].split()[1])
+            except (OSError, IndexError, ValueError):
+                continue
+            if ppid == self.process.pid:
+                pids.append(int(entry))
+        return sorted(pids)
+
+    def peak_rss(self):
+        # VmHWM is the peak resident set size of each worker since it started
+        workers = []
+        for pid in self.worker_pids():
+            try:
+                with open(f'/proc/{pid}/status') as f:
+                    status = dict(line.split(':', 1) for line in f if ':' in line)
+            except OSError:
+                continue
+            workers.append({'pid': pid, 'peak_rss_kb': int(status['VmHWM'].split()[0])})
+        return workers
+
+    def stop(self):
+        self.process.send_signal(signal.SIGTERM)
+        try:
+            self.process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+
+
+def request(conn, method, path, headers=None, body=None):
+    start = time.perf_counter()
+    conn.request(method, path, body=body, headers=headers or {})
+    response = conn.getresponse()
+    data = response.read()
+    return response.status, time.perf_counter() - start, data
+
+
+def wait_ready(port, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+            status, _, _ = request(conn, 'GET', '/readyz')
+            conn.close()
+            if status == 200:
+                return
+        except OSError:
+            pass
+        time.sleep(0.25)
+    raise RuntimeError("App did not become ready in time")
+
+
+def login(port):
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=10)
+    body = urllib.parse.urlencode({'username': 'admin', 'password': 'admin'})
+    status, _, data = request(conn, 'POST', '/login', {'Content-Type': 'application/x-www-form-urlencoded'}, body)
+    conn.close()
+    if status != 200:
+        raise RuntimeError(f"Login failed with {status}")
+    return json.loads(data)['token']
+
+
+def midpoint_cursor(port, products):
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=10)
+    _, _, data = request(conn, 'GET', f'/products?skip={max(products // 2 - 1, 0)}&limit=1')
+    conn.close()
+    return json.loads(data).get('next', '')
+
+
+def scenarios(args, token, cursor):
+    n = args.products
+    auth = {'Authorization': f'Bearer {token}', 'Content-Type': 'application/json'}
+    new_ids = itertools.count(n + 1)
+    # Delete from the top of the seeded range: every worker's copy has those ids
+    doomed = itertools.count(n, -1)
+
+    def get(path):
+        return lambda rng: ('GET', path, None, None)
+
+    def product(rng):
+        return 'GET', f'/products/{rng.randint(1, n)}', None, None
+
+    def category(rng):
+        return 'GET', f'/products/category/{rng.choice(standin.CATEGORIES)}?limit=30', None, None
+
+    def create(rng):
+        body = json.dumps(standin.sample_product(next(new_ids), rng))
+        return 'POST', '/products', auth, body
+
+    def delete(rng):
+        return 'DELETE', f'/products/{next(doomed)}', auth, None
+
+    return [
+        ('GET /products?limit=30', get('/products?limit=30')),
+        ('GET /products?limit=100', get('/products?limit=100')),
+        ('GET /products?skip=mid&limit=30', get(f'/products?skip={n // 2}&limit=30')),
+        ('GET /products?skip=deep&limit=30', get(f'/products?skip={max(n - 30, 0)}&limit=30')),
+        ('GET /products?after=mid&limit=30', get(f'/products?after={cursor}&limit=30')),
+        ('GET /products/<id>', product),
+        ('GET /products/category/<name>', category),
+        ('POST /products', create),
+        # Last, since it shrinks the catalog
+        ('DELETE /products/<id>', delete),
+    ]
+
+
+def run_scenario(args, build_request):
+    latencies = []
+    statuses = {}
+    lock = threading.Lock()
+    deadline = time.monotonic() + args.duration
+
+    def worker(seed):
+        rng = random.Random(seed)
+        conn = http.client.HTTPConnection('127.0.0.1', args.port, timeout=30)
+        local_latencies = []
+        local_statuses = {}
+        while time.monotonic() < deadline:
+            method, path, headers, body = build_request(rng)
+            headers = dict(headers or {})
+            if args.gzip:
+                headers['Accept-Encoding'] = 'gzip'
+            try:
+                status, elapsed, _ = request(conn, method, path, headers, body)
+            except (OSError, http.client.HTTPException):
+                conn.close()
+                conn = http.client.HTTPConnection('127.0.0.1', args.port, timeout=30)
+                status, elapsed = 'error', None
+            local_statuses[str(status)] = local_statuses.get(str(status), 0) + 1
+            if elapsed is not None:
+                local_latencies.append(elapsed)
+        conn.close()
+        with lock:
+            latencies.extend(local_latencies)
+            for status, count in local_statuses.items():
+                statuses[status] = statuses.get(status, 0) + count
+
+    started = time.monotonic()
+    threads = [threading.Thread(target=worker, args=(seed,)) for seed in range(args.concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - started
+    return summarize(latencies, statuses, elapsed)
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    index = max(0, min(len(sorted_values) - 1, int(round(pct / 100 * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def summarize(latencies, statuses, elapsed):
+    latencies.sort()
+    ms = lambda value: None if value is None else round(value * 1000, 3)
+    requests = sum(statuses.values())
+    errors = sum(count for status, count in statuses.items() if not status.startswith(('2', '3')))
+    return {
+        'requests': requests,
+        'errors': errors,
+        'statuses': statuses,
+        'rps': round(requests / elapsed, 1) if elapsed else 0,
+        'latency_ms': {
+            'p50': ms(percentile(latencies, 50)),
+            'p95': ms(percentile(latencies, 95)),
+            'p99': ms(percentile(latencies, 99)),
+            'mean': ms(sum(latencies) / len(latencies)) if latencies else None,
+            'max': ms(latencies[-1]) if latencies else None,
+        }
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(baseline, report):
+    print(f"{'route':<36} {'p50 ms':>20} {'p99 ms':>20} {'rps':>20}")
+    for name, current in report['routes'].items():
+        previous = baseline.get('routes', {}).get(name)
+        if not previous:
+            continue
+        cells = []
+        for old, new in (
+            (previous['latency_ms']['p50'], current['latency_ms']['p50']),
+            (previous['latency_ms']['p99'], current['latency_ms']['p99']),
+            (previous['rps'], current['rps']),
+        ):
+            change = f"{(new - old) / old * 100:+.0f}%" if old and new is not None else 'n/a'
+            cells.append(f"{old} -> {new} ({change})")
+        print(f"{name:<36} " + ' '.join(f"{cell:>20}" for cell in cells))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test every route of the app")
+    parser.add_argument('--products', type=int, default=1000, help="catalog size to seed")
+    parser.add_argument('--workers', type=int, default=2, help="gunicorn workers")
+    parser.add_argument('--threads', type=int, default=8, help="threads per gunicorn worker")
+    parser.add_argument('--concurrency', type=int, default=16, help="concurrent client connections")
+    parser.add_argument('--duration', type=float, default=5, help="seconds per route")
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--no-gzip', dest='gzip', action='store_false', help="don't send Accept-Encoding: gzip")
+    parser.add_argument('--route', action='append', help="only run routes containing this text")
+    parser.add_argument('--mongo-uri', help="benchmark a real (throwaway!) MongoDB instead of the stand-in")
+    parser.add_argument('--seed', action='store_true', help="reseed the pseudojson.products collection at --mongo-uri")
+    parser.add_argument('--output', help="write the JSON report here (default: stdout)")
+    parser.add_argument('--baseline', help="earlier report to compare against")
+    args = parser.parse_args()
+
+    if args.mongo_uri and args.seed:
+        from pymongo import MongoClient
+        standin.seed(MongoClient(args.mongo_uri).pseudojson.products, args.products)
+
+    server = Server(args)
+    try:
+        wait_ready(args.port)
+        token = login(args.port)
+        cursor = midpoint_cursor(args.port, args.products)
+        routes = {}
+        for name, build_request in scenarios(args, token, cursor):
+            if args.route and not any(part in name for part in args.route):
+                continue
+            routes[name] = run_scenario(args, build_request)
+            print(f"{name}: {routes[name]['rps']} req/s, p99 {routes[name]['latency_ms']['p99']} ms", file=sys.stderr)
+        workers = server.peak_rss()
+    finally:
+        server.stop()
+
+    report = {
+        'meta': {
+            'revision': git_revision(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'backend': 'mongodb' if args.mongo_uri else 'stand-in',
+            'products': args.products,
+            'workers': args.workers,
+            'threads': args.threads,
+            'concurrency': args.concurrency,
+            'duration': args.duration,
+            'gzip': args.gzip,
+        },
+        'routes': routes,
+        'workers': workers,
+    }
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            compare(json.load(f), report)
+
+
+if __name__ == '__main__':
+    main()
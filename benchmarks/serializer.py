@@ -0,0 +1,79 @@
+# Microbenchmark: per-document cost of the old dict + jsonify path against the
+# RawBSON serializer. Run with: python -m benchmarks.serializer
+import argparse
+import json
+import time
+
+import bson
+from bson.objectid import ObjectId
+from bson.raw_bson import RawBSONDocument
+from flask import Flask, jsonify
+
+import serializer
+
+
+def sample_documents(count):
+    return [RawBSONDocument(bson.encode({
+        '_id': ObjectId(),
+        'id': i,
+        'title': 'iPhone 15 pro',
+        'description': 'An apple mobile which is nothing like apple',
+        'price': 1449,
+        'discountPercentage': 12.96,
+        'rating': 4.69,
+        'stock': 188,
+        'brand': 'Apple',
+        'category': 'smartphones',
+        'category_key': 'smartphones',
+        'thumbnail': 'https://unsplash.com/photos/a-close-up-of-a-person-holding-a-cell-phone-KX_7S9bXYjY',
+        'images': ['https://unsplash.com/photos/a-close-up-of-a-person-holding-a-cell-phone-KX_7S9bXYjY'],
+        '_version': 1
+    })) for i in range(count)]
+
+
+def jsonify_path(app, documents):
+    # What the routes did before: decode to dicts, patch _id in a loop, jsonify
+    with app.app_context():
+        products = [bson.decode(document.raw) for document in documents]
+        for product in products:
+            product['_id'] = str(product['_id'])
+        return jsonify({"products": products, "total": len(products)}).get_data()
+
+
+def serializer_path(documents):
+    page, count, _ = serializer.encode_page(documents)
+    return serializer.encode_envelope(page, total=count)
+
+
+def measure(fn, documents, rounds):
+    fn()
+    start = time.perf_counter()
+    for _ in range(rounds):
+        fn()
+    return (time.perf_counter() - start) / rounds / len(documents) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--docs', type=int, default=1000)
+    parser.add_argument('--rounds', type=int, default=50)
+    args = parser.parse_args()
+
+    app = Flask(__name__)
+    documents = sample_documents(args.docs)
+    assert json.loads(jsonify_path(app, documents)) == json.loads(serializer_path(documents))
+
+    before = measure(lambda: jsonify_path(app, documents), documents, args.rounds)
+    after = measure(lambda: serializer_path(documents), documents, args.rounds)
+    print(json.dumps({
+        "docs": args.docs,
+        "rounds": args.rounds,
+        "encoder": "orjson" if serializer.orjson else "json",
+        "jsonify_us_per_doc": round(before, 3),
+        "serializer_us_per_doc": round(after, 3),
+        "speedup": round(before / after, 2)
+    }))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,11 @@
+# WSGI entry point the load generator boots: `gunicorn benchmarks.server:app`.
+# BENCH_MONGO_URI points it at a real server; otherwise it runs on the stand-in.
+import os
+
+from app import create_app
+
+if os.getenv("BENCH_MONGO_URI"):
+    app = create_app({'MONGO_URI': os.environ["BENCH_MONGO_URI"]})
+else:
+    from benchmarks import standin
+    app = create_app({'MONGO_CLIENT': standin.make_client(int(os.getenv("BENCH_PRODUCTS", "1000")))})
@@ -0,0 +1,99 @@
+# Local MongoDB stand-in for benchmarks: an in-memory mongomock client seeded with
+# a deterministic catalog. mongomock has no RawBSONDocument support, so collections
+# asked for raw documents are wrapped to hand back BSON-encoded copies.
+import random
+
+import bson
+import mongomock
+from bson.raw_bson import RawBSONDocument
+from mongomock.collection import Collection
+
+CATEGORIES = ['smartphones', 'laptops', 'fragrances', 'skincare', 'groceries', 'home-decoration']
+BRANDS = ['Apple', 'Samsung', 'OPPO', 'Huawei', 'Microsoft', 'HP', 'Dell', 'Infinix']
+
+
+def _raw(document):
+    return RawBSONDocument(bson.encode(document))
+
+
+class RawCursor:
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def __getattr__(self, name):
+        method = getattr(self._cursor, name)
+
+        def chained(*args, **kwargs):
+            result = method(*args, **kwargs)
+            return self if result is self._cursor else result
+        return chained
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return _raw(next(self._cursor))
+
+
+class RawCollection:
+    def __init__(self, collection):
+        self._collection = collection
+
+    def __getattr__(self, name):
+        return getattr(self._collection, name)
+
+    def find(self, *args, **kwargs):
+        return RawCursor(self._collection.find(*args, **kwargs))
+
+    def aggregate(self, *args, **kwargs):
+        return (_raw(document) for document in self._collection.aggregate(*args, **kwargs))
+
+
+_with_options = Collection.with_options
+
+
+def _raw_aware_with_options(self, codec_options=None, **kwargs):
+    if codec_options is not None and codec_options.document_class is RawBSONDocument:
+        return RawCollection(self)
+    return _with_options(self, codec_options=codec_options, **kwargs)
+
+
+Collection.with_options = _raw_aware_with_options
+
+
+def sample_product(id, rng):
+    category = CATEGORIES[id % len(CATEGORIES)]
+    return {
+        'id': id,
+        'title': f"{rng.choice(BRANDS)} product {id}",
+        'description': f"Sample {category} item number {id} used for load testing",
+        'price': rng.randint(5, 2000),
+        'discountPercentage': round(rng.uniform(0, 20), 2),
+        'rating': round(rng.uniform(1, 5), 2),
+        'stock': rng.randint(0, 500),
+        'brand': rng.choice(BRANDS),
+        'category': category,
+        'category_key': category,
+        'thumbnail': f"https://example.com/{id}/thumbnail.jpg",
+        'images': [f"https://example.com/{id}/1.jpg", f"https://example.com/{id}/2.jpg"],
+        '_version': 1
+    }
+
+
+def seed(collection, count, seed=42):
+    rng = random.Random(seed)
+    collection.delete_many({})
+    batch = []
+    for id in range(1, count + 1):
+        batch.append(sample_product(id, rng))
+        if len(batch) == 1000:
+            collection.insert_many(batch)
+            batch = []
+    if batch:
+        collection.insert_many(batch)
+
+
+def make_client(products=1000):
+    client = mongomock.MongoClient()
+    seed(client.pseudojson.products, products)
+    return client
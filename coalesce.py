@@ -0,0 +1,94 @@
+import threading
+import time
+
+from pymongo.errors import BulkWriteError, DuplicateKeyError, WriteError
+
+from metrics import Histogram
+
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256)
+WAIT_BUCKETS = (0.0005, 0.001, 0.002, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+
+
+class _Batch:
+    def __init__(self, collection):
+        self.collection = collection
+        self.documents = []
+        self.errors = {}
+        # Raised to every waiter whose document was inserted when after_batch fails
+        self.after_error = None
+        self.full = threading.Event()
+        self.done = threading.Event()
+
+
+class InsertCoalescer:
+    # Group commit for single-document inserts. The first request to arrive opens a
+    # batch and becomes its leader; requests arriving within `window` seconds join it.
+    # The leader sends the whole batch as one insert_many(ordered=False) once the
+    # window closes or `max_batch` documents are queued, then every waiter gets its
+    # own inserted _id or error back. after_batch runs once per batch that inserted
+    # anything, so per-write bookkeeping is paid per batch instead of per document.
+
+    def __init__(self, registry, window=0.002, max_batch=64, after_batch=None):
+        self.window = window
+        self.max_batch = max_batch
+        self.after_batch = after_batch
+        self._batch = None
+        self._lock = threading.Lock()
+        self.batch_size = registry.register(Histogram(
+            'mongodb_insert_batch_size', 'Documents per coalesced insert_many', buckets=BATCH_SIZE_BUCKETS
+        ))
+        self.wait_time = registry.register(Histogram(
+            'mongodb_insert_coalesce_wait_seconds', 'Time an insert spent queued plus its batch write',
+            buckets=WAIT_BUCKETS
+        ))
+
+    def insert(self, collection, document):
+        start = time.monotonic()
+        with self._lock:
+            batch = self._batch
+            leader = batch is None or batch.collection is not collection
+            if leader:
+                # A reconnect swaps the collection object; never mix the two in one batch
+                batch = self._batch = _Batch(collection)
+            index = len(batch.documents)
+            batch.documents.append(document)
+            if len(batch.documents) >= self.max_batch:
+                self._batch = None
+                batch.full.set()
+
+        if leader:
+            batch.full.wait(self.window)
+            with self._lock:
+                if self._batch is batch:
+                    self._batch = None
+            self._flush(batch)
+        else:
+            batch.done.wait()
+        self.wait_time.observe(time.monotonic() - start)
+
+        error = batch.errors.get(index)
+        if error is not None:
+            raise error
+        if batch.after_error is not None:
+            raise batch.after_error
+        return document['_id']
+
+    def _flush(self, batch):
+        self.batch_size.observe(len(batch.documents))
+        try:
+            batch.collection.insert_many(batch.documents, ordered=False)
+        except BulkWriteError as e:
+            # Unordered: every document without a write error was inserted
+            for error in e.details.get('writeErrors', []):
+                cls = DuplicateKeyError if error.get('code') == 11000 else WriteError
+                batch.errors[error['index']] = cls(error.get('errmsg'), error.get('code'), error)
+        except Exception as e:
+            for index in range(len(batch.documents)):
+                batch.errors[index] = e
+        try:
+            if self.after_batch and len(batch.errors) < len(batch.documents):
+                self.after_batch()
+        except Exception as e:
+            batch.after_error = e
+        finally:
+            batch.done.set()
@@ -0,0 +1,89 @@
+import hashlib
+import zlib
+
+from flask import request
+
+from cache import LRUCache
+
+COMPRESSIBLE_TYPES = {
+    'application/json', 'application/x-ndjson', 'application/javascript',
+    'text/html', 'text/css', 'text/plain', 'text/javascript', 'image/svg+xml'
+}
+
+# zlib wbits for each Content-Encoding we negotiate
+WBITS = {'gzip': 31, 'deflate': 15}
+
+
+class Compressor:
+    # after_request hook negotiating gzip/deflate from Accept-Encoding. Bodies of
+    # responses with a validator (ETag) or of rendered pages are kept compressed in
+    # an LRU, so a hot product, page or stylesheet is compressed only once.
+
+    def __init__(self, min_size=500, level=6, cache_size=512, cache_ttl=300):
+        self.min_size = min_size
+        self.level = level
+        self.cache = LRUCache(maxsize=cache_size, ttl=cache_ttl)
+
+    def compress(self, data, encoding):
+        compressor = zlib.compressobj(self.level, zlib.DEFLATED, WBITS[encoding])
+        return compressor.compress(data) + compressor.flush()
+
+    def compress_stream(self, chunks, encoding):
+        compressor = zlib.compressobj(self.level, zlib.DEFLATED, WBITS[encoding])
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode()
+            # Sync-flush every chunk: zlib would otherwise hold output until its buffer
+            # fills and the client would see nothing until the end of the stream
+            data = compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+            if data:
+                yield data
+        yield compressor.flush()
+
+    def _cache_key(self, response, data):
+        etag, weak = response.get_etag()
+        if etag and not weak:
+            return (request.path, etag)
+        if response.mimetype == 'text/html':
+            return (request.path, hashlib.blake2b(data, digest_size=16).hexdigest())
+        return None
+
+    def after_request(self, response):
+        if (response.status_code != 200 or 'Content-Encoding' in response.headers
+                or response.mimetype not in COMPRESSIBLE_TYPES):
+            return response
+        response.vary.add('Accept-Encoding')
+        encoding = request.accept_encodings.best_match(['gzip', 'deflate'])
+        if not encoding:
+            return response
+
+        etag, weak = response.get_etag()
+        if etag and not weak and f"{etag}-{encoding}" in request.if_none_match:
+            # The client already holds this encoded variant
+            response.close()
+            not_modified = response.__class__(status=304)
+            not_modified.set_etag(f"{etag}-{encoding}")
+            not_modified.vary.add('Accept-Encoding')
+            return not_modified
+
+        if response.is_streamed and not response.direct_passthrough:
+            response.response = self.compress_stream(response.response, encoding)
+        else:
+            # Static files are sent as a file wrapper, read them into memory first
+            response.direct_passthrough = False
+            data = response.get_data()
+            if len(data) < self.min_size:
+                return response
+            key = self._cache_key(response, data)
+            body = self.cache.get(key + (encoding,)) if key else None
+            if body is None:
+                body = self.compress(data, encoding)
+                if key:
+                    self.cache.set(key + (encoding,), body)
+            response.set_data(body)
+
+        response.headers['Content-Encoding'] = encoding
+        if etag and not weak:
+            # Each encoding is a distinct representation with its own strong ETag
+            response.set_etag(f"{etag}-{encoding}")
+        return response
@@ -0,0 +1,44 @@
+# Serving profile for `gunicorn -c gunicorn.conf.py app:app`.
+# Requests spend most of their time waiting on Mongo, so each worker runs a
+# thread pool (gthread) and gets its own MongoClient after fork.
+import multiprocessing
+import os
+import sys
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "gthread")
+workers = int(os.getenv("WEB_CONCURRENCY", multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.getenv("GUNICORN_THREADS", "8"))
+
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "30"))
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", "20"))
+keepalive = int(os.getenv("GUNICORN_KEEPALIVE", "5"))
+
+# Recycle workers now and then to cap slow memory growth
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", "5000"))
+max_requests_jitter = int(os.getenv("GUNICORN_MAX_REQUESTS_JITTER", "500"))
+
+preload_app = os.getenv("GUNICORN_PRELOAD", "1") == "1"
+
+# Every thread may hold a connection, and the pool should never be the bottleneck
+os.environ.setdefault("MONGO_MAX_POOL_SIZE", str(threads * 2))
+os.environ.setdefault("MONGO_MIN_POOL_SIZE", str(min(threads, 4)))
+os.environ.setdefault("MONGO_WAIT_QUEUE_TIMEOUT_MS", "2000")
+
+accesslog = os.getenv("GUNICORN_ACCESS_LOG", "-") or None
+
+
+def post_fork(server, worker):
+    # With preload_app the module was imported in the master. MongoClient is not
+    # fork-safe, so drop anything inherited and let each worker open its own.
+    app_module = sys.modules.get("app")
+    if app_module is not None:
+        app_module.reset_connection()
+
+
+def post_worker_init(worker):
+    # Connect, build indexes and warm caches in the background before traffic arrives
+    app_module = sys.modules.get("app")
+    if app_module is not None:
+        app_module.start_warmup(worker.wsgi)
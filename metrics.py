@@ -0,0 +1,179 @@
+import bisect
+import os
+import threading
+
+from pymongo import monitoring
+
+# Latency buckets in seconds, tuned for a JSON API backed by Mongo
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+def _labels(names, values):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Counter:
+    type = 'counter'
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        for labels, value in values.items():
+            yield self.name, _labels(self.labels, labels), value
+
+
+class Gauge:
+    # Value comes from a callback at scrape time, so nothing is tracked on the hot path
+    type = 'gauge'
+
+    def __init__(self, name, help, callback):
+        self.name = name
+        self.help = help
+        self.callback = callback
+
+    def samples(self):
+        yield self.name, '', self.callback()
+
+
+class Histogram:
+    type = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                entry = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    def samples(self):
+        with self._lock:
+            values = {labels: ([*counts], total) for labels, (counts, total) in self._values.items()}
+        for labels, (counts, total) in values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                yield self.name + '_bucket', _labels(self.labels + ('le',), labels + (le,)), cumulative
+            yield self.name + '_count', _labels(self.labels, labels), cumulative
+            yield self.name + '_sum', _labels(self.labels, labels), total
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        # Each gunicorn worker keeps its own registry; the pid label keeps their series apart
+        worker = f'worker="{os.getpid()}"'
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            for name, labels, value in metric.samples():
+                labels = '{' + worker + (',' + labels[1:] if labels else '}')
+                lines.append(f"{name}{labels} {value}")
+        return '\n'.join(lines) + '\n'
+
+
+class CommandMetrics(monitoring.CommandListener):
+    # pymongo publishes command events on the thread that issued the command, so
+    # route() can tell which endpoint the command belongs to
+
+    def __init__(self, registry, route):
+        self.route = route
+        self.duration = registry.register(Histogram(
+            'mongodb_command_duration_seconds', 'MongoDB command latency by command and route',
+            labels=('command', 'route')
+        ))
+        self.failures = registry.register(Counter(
+            'mongodb_command_failures_total', 'Failed MongoDB commands by command and route',
+            labels=('command', 'route')
+        ))
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        self.duration.observe(event.duration_micros / 1e6, event.command_name, self.route())
+
+    def failed(self, event):
+        self.duration.observe(event.duration_micros / 1e6, event.command_name, self.route())
+        self.failures.inc(event.command_name, self.route())
+
+
+class PoolMetrics(monitoring.ConnectionPoolListener):
+    def __init__(self, registry):
+        self.wait = registry.register(Histogram(
+            'mongodb_pool_checkout_wait_seconds', 'Time spent waiting to check out a pooled connection'
+        ))
+        self.checkouts = registry.register(Counter(
+            'mongodb_pool_checkouts_total', 'Connection checkouts by outcome', labels=('outcome',)
+        ))
+        self.connections = registry.register(Counter(
+            'mongodb_pool_connections_total', 'Connections opened and closed', labels=('event',)
+        ))
+
+    def connection_checked_out(self, event):
+        self.wait.observe(event.duration)
+        self.checkouts.inc('ok')
+
+    def connection_check_out_failed(self, event):
+        self.wait.observe(event.duration)
+        self.checkouts.inc(str(event.reason))
+
+    def connection_created(self, event):
+        self.connections.inc('created')
+
+    def connection_closed(self, event):
+        self.connections.inc('closed')
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_checked_in(self, event):
+        pass
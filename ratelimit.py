@@ -0,0 +1,106 @@
+import datetime
+import math
+import threading
+import time
+from collections import OrderedDict
+
+from pymongo import ReturnDocument
+
+
+class TokenBucketLimiter:
+    # In-process token buckets, one per client key. Each bucket holds up to `burst`
+    # tokens and refills at `rate` per second; the least recently seen keys are
+    # dropped once max_keys is reached.
+
+    def __init__(self, rate, burst, max_keys=10000):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def hit(self, key):
+        # Returns 0 when the request may proceed, otherwise seconds until it would
+        now = time.monotonic()
+        with self._lock:
+            tokens, last = self._buckets.pop(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - last) * self.rate)
+            if tokens >= 1:
+                tokens -= 1
+                retry_after = 0
+            else:
+                retry_after = (1 - tokens) / self.rate
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return retry_after
+
+
+class MongoWindowLimiter:
+    # Shared fixed-window counters so a limit holds across all workers. A window
+    # lasts burst / rate seconds and admits `burst` requests; expired windows are
+    # removed by a TTL index.
+
+    def __init__(self, collection, rate, burst):
+        self.collection = collection
+        self.limit = burst
+        self.window = burst / rate
+
+    def ensure_indexes(self):
+        self.collection.create_index('expires_at', expireAfterSeconds=0)
+
+    def hit(self, key):
+        now = time.time()
+        start = math.floor(now / self.window) * self.window
+        end = start + self.window
+        doc = self.collection.find_one_and_update(
+            {'_id': f"{key}:{start}"},
+            {
+                '$inc': {'n': 1},
+                '$setOnInsert': {'expires_at': datetime.datetime.fromtimestamp(end, datetime.timezone.utc)}
+            },
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        return 0 if doc['n'] <= self.limit else end - now
+
+
+class RateLimiter:
+    # Separate read and write budgets. The local bucket always runs first so a
+    # client already over its budget never costs a round trip to the shared backend.
+
+    def __init__(self, read, write, shared=None):
+        self.local = {'read': read, 'write': write}
+        self.shared = shared or {}
+
+    def hit(self, kind, key):
+        retry_after = self.local[kind].hit(key)
+        if not retry_after and kind in self.shared:
+            retry_after = self.shared[kind].hit(key)
+        return retry_after
+
+
+class InFlightGauge:
+    def __init__(self, limit):
+        self.limit = limit
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        # False when the process is already at its limit and the request should be shed
+        with self._lock:
+            if self.limit and self.value >= self.limit:
+                return False
+            self.value += 1
+            return True
+
+    def release(self):
+        with self._lock:
+            self.value -= 1
+
+
+def parse_rate(value):
+    # "20/40" -> 20 requests per second with bursts of up to 40
+    rate, _, burst = value.partition('/')
+    rate = float(rate)
+    return rate, float(burst) if burst else rate
@@ -0,0 +1,83 @@
+import datetime
+import hashlib
+import threading
+import time
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+# A revocation takes its seq and writes its entry in two round trips, so a higher seq
+# can land first. Each sync re-reads this many seqs below the highest one it has seen.
+SYNC_LOOKBACK = 100
+
+
+class RevocationStore:
+    # Revoked tokens live in a Mongo TTL collection shared by every worker.
+    # Each worker mirrors them in a local dict and pulls new revocations at most
+    # once per sync_interval, so lookups stay O(1) with no per-request round trip.
+
+    def __init__(self, collection, counters, sync_interval=1.0):
+        self.collection = collection
+        self.counters = counters
+        self.sync_interval = sync_interval
+        self._revoked = {}
+        self._seq = 0
+        self._next_sync = 0.0
+        self._lock = threading.Lock()
+
+    def ensure_indexes(self):
+        # Mongo drops each entry once the token it refers to has expired
+        self.collection.create_index('expires_at', expireAfterSeconds=0)
+        self.collection.create_index('seq')
+
+    @staticmethod
+    def _key(token):
+        return hashlib.sha256(token.encode()).hexdigest()
+
+    def revoke(self, token, exp):
+        key = self._key(token)
+        try:
+            doc = self.counters.find_one_and_update(
+                {'_id': 'revocations'}, {'$inc': {'seq': 1}}, upsert=True, return_document=ReturnDocument.AFTER
+            )
+        except DuplicateKeyError:
+            # Two first-ever revocations raced on the upsert; the counter exists now
+            doc = self.counters.find_one_and_update(
+                {'_id': 'revocations'}, {'$inc': {'seq': 1}}, return_document=ReturnDocument.AFTER
+            )
+        self.collection.update_one(
+            {'_id': key},
+            {'$set': {
+                'seq': doc['seq'],
+                'expires_at': datetime.datetime.fromtimestamp(exp, datetime.timezone.utc)
+            }},
+            upsert=True
+        )
+        with self._lock:
+            self._revoked[key] = exp
+
+    def is_revoked(self, token):
+        now = time.time()
+        if time.monotonic() >= self._next_sync:
+            self.sync(now)
+        exp = self._revoked.get(self._key(token))
+        return exp is not None and exp > now
+
+    def sync(self, now=None):
+        now = now or time.time()
+        with self._lock:
+            self._next_sync = time.monotonic() + self.sync_interval
+            seq = self._seq
+        docs = list(self.collection.find({'seq': {'$gt': seq - SYNC_LOOKBACK}}).sort('seq', 1))
+        with self._lock:
+            for doc in docs:
+                expires_at = doc['expires_at']
+                if expires_at.tzinfo is None:
+                    expires_at = expires_at.replace(tzinfo=datetime.timezone.utc)
+                self._revoked[doc['_id']] = expires_at.timestamp()
+                self._seq = max(self._seq, doc['seq'])
+            for key in [key for key, exp in self._revoked.items() if exp <= now]:
+                del self._revoked[key]
+
+    def __len__(self):
+        return len(self._revoked)
@@ -0,0 +1,88 @@
+import datetime
+import decimal
+import json
+import uuid
+
+import bson
+from bson.codec_options import CodecOptions
+from bson.decimal128 import Decimal128
+from bson.objectid import ObjectId
+from bson.raw_bson import RawBSONDocument
+from werkzeug.http import http_date
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Cursors opened with these options hand back undecoded BSON bytes
+RAW_CODEC_OPTIONS = CodecOptions(document_class=RawBSONDocument)
+
+# Bookkeeping stored on product documents that is never part of a response
+INTERNAL_FIELDS = ('_version', 'category_key')
+
+
+def _default(value):
+    # Same representations Flask's JSON provider uses, so responses don't change shape
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return http_date(value)
+    if isinstance(value, Decimal128):
+        return str(value.to_decimal())
+    if isinstance(value, (decimal.Decimal, uuid.UUID)):
+        return str(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+if orjson is not None:
+    def dumps(obj):
+        return orjson.dumps(obj, default=_default, option=orjson.OPT_PASSTHROUGH_DATETIME)
+else:
+    _encoder = json.JSONEncoder(separators=(',', ':'), default=_default)
+
+    def dumps(obj):
+        return _encoder.encode(obj).encode()
+
+
+def decode(document, fields=None):
+    # One C-level pass from wire bytes; the result goes straight to the encoder and
+    # is never touched by route code
+    if isinstance(document, RawBSONDocument):
+        product = bson.decode(document.raw)
+    else:
+        product = dict(document)
+    strip_internal(product, fields)
+    return product
+
+
+def strip_internal(product, fields=None):
+    for name in INTERNAL_FIELDS:
+        product.pop(name, None)
+    # _id may be projected for validators without having been asked for
+    if fields is not None and '_id' not in fields:
+        product.pop('_id', None)
+    return product
+
+
+def encode_product(document, fields=None):
+    return dumps(decode(document, fields))
+
+
+def encode_page(documents, fields=None):
+    # Returns the JSON array, how many products it holds and the last id (for cursors)
+    documents = list(documents)
+    if all(isinstance(document, RawBSONDocument) for document in documents):
+        # The whole page is decoded by one C call over the concatenated wire bytes
+        page = bson.decode_all(b''.join(document.raw for document in documents))
+    else:
+        page = [dict(document) for document in documents]
+    for product in page:
+        strip_internal(product, fields)
+    last_id = page[-1].get('id') if page else None
+    # A single encoder call for the whole page keeps per-call setup out of the loop
+    return dumps(page), len(page), last_id
+
+
+def encode_envelope(products_json, **extra):
+    return b'{"products":' + products_json + b',' + dumps(extra)[1:]
@@ -0,0 +1,158 @@
+import collections
+import json
+import logging
+import queue
+import random
+import threading
+import time
+
+from pymongo import monitoring
+
+EXPLAINABLE = {'find', 'aggregate', 'count', 'distinct'}
+# Plan stages worth flagging: a full collection scan, or a sort done in memory
+FLAGGED_STAGES = {'COLLSCAN', 'SORT'}
+# Driver/session fields that explain rejects or that carry no query shape
+_SESSION_FIELDS = {'lsid', 'txnNumber', 'autocommit', 'startTransaction'}
+
+
+def redact(value):
+    # Keep operators and field names, replace every literal with "?"
+    if isinstance(value, dict):
+        return {key: redact(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [redact(item) for item in value]
+    return '?'
+
+
+def query_shape(command_name, command):
+    if command_name == 'find':
+        shape = {'filter': command.get('filter', {})}
+        if command.get('sort'):
+            shape['sort'] = command['sort']
+    elif command_name == 'aggregate':
+        shape = {'pipeline': command.get('pipeline', [])}
+    elif command_name in ('count', 'distinct'):
+        shape = {'query': command.get('query', {})}
+    elif command_name in ('update', 'delete'):
+        shape = {'q': [op.get('q', {}) for op in command.get(command_name + 's', [])][:1]}
+    elif command_name == 'findAndModify':
+        shape = {'query': command.get('query', {})}
+    else:
+        return None
+    redacted = redact(shape)
+    if 'sort' in shape:
+        redacted['sort'] = dict(shape['sort'])
+    return redacted
+
+
+def plan_stages(plan):
+    stages = []
+    if isinstance(plan, dict):
+        if 'stage' in plan:
+            stages.append(plan['stage'])
+        for key, value in plan.items():
+            if key in ('inputStage', 'queryPlanner', 'winningPlan', 'queryPlan') or key.startswith('$'):
+                stages.extend(plan_stages(value))
+            elif key in ('inputStages', 'stages', 'shards'):
+                for item in value:
+                    stages.extend(plan_stages(item))
+    return stages
+
+
+class SlowQueryRecorder(monitoring.CommandListener):
+    # Records Mongo commands slower than threshold_ms into a bounded ring, with the
+    # route that issued them and a redacted filter shape. A sample of slow commands
+    # is explained on a background thread and flagged for COLLSCAN / in-memory SORT.
+
+    def __init__(self, route, threshold_ms=100, explain_rate=0.1, size=200, log_path=None):
+        self.route = route
+        self.threshold_ms = threshold_ms
+        self.explain_rate = explain_rate
+        self.entries = collections.deque(maxlen=size)
+        self.run_explain = None
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._explain_queue = queue.Queue(maxsize=100)
+        self._explain_thread = None
+        self.logger = None
+        if log_path:
+            self.logger = logging.getLogger('pseudojson.slow_queries')
+            handler = logging.FileHandler(log_path)
+            handler.setFormatter(logging.Formatter('%(message)s'))
+            self.logger.addHandler(handler)
+            self.logger.setLevel(logging.INFO)
+            self.logger.propagate = False
+
+    def started(self, event):
+        if event.command_name == 'explain':
+            return
+        with self._lock:
+            self._pending[(event.connection_id, event.request_id)] = (event.command, self.route())
+
+    def succeeded(self, event):
+        self._finish(event)
+
+    def failed(self, event):
+        self._finish(event)
+
+    def _finish(self, event):
+        with self._lock:
+            started = self._pending.pop((event.connection_id, event.request_id), None)
+        if started is None or event.duration_micros < self.threshold_ms * 1000:
+            return
+        command, route = started
+        entry = {
+            'time': time.time(),
+            'route': route,
+            'command': event.command_name,
+            'collection': command.get(event.command_name),
+            'shape': query_shape(event.command_name, command),
+            'duration_ms': round(event.duration_micros / 1000, 3),
+        }
+        with self._lock:
+            self.entries.append(entry)
+        if (self.run_explain and event.command_name in EXPLAINABLE
+                and random.random() < self.explain_rate):
+            explain_command = {k: v for k, v in command.items() if k not in _SESSION_FIELDS and not k.startswith('$')}
+            try:
+                # Logged by the explain thread once the plan is known
+                self._explain_queue.put_nowait((entry, event.database_name, explain_command))
+                self._ensure_explain_thread()
+                return
+            except queue.Full:
+                pass
+        self._log(entry)
+
+    def _log(self, entry):
+        if self.logger:
+            self.logger.info(json.dumps(entry, default=str))
+
+    def _ensure_explain_thread(self):
+        if self._explain_thread is None or not self._explain_thread.is_alive():
+            self._explain_thread = threading.Thread(target=self._explain_loop, name='slow-query-explain', daemon=True)
+            self._explain_thread.start()
+
+    def _explain_loop(self):
+        while True:
+            entry, database_name, command = self._explain_queue.get()
+            # Entries in the ring may be serialized concurrently; publish a new dict
+            # instead of mutating the one already there
+            explained = dict(entry)
+            try:
+                stages = plan_stages(self.run_explain(database_name, command))
+                explained['plan'] = stages
+                explained['flags'] = sorted(FLAGGED_STAGES.intersection(stages))
+            except Exception as e:
+                explained['explain_error'] = str(e)
+            with self._lock:
+                for index, existing in enumerate(self.entries):
+                    if existing is entry:
+                        self.entries[index] = explained
+                        break
+            self._log(explained)
+
+    def recent(self, limit=None):
+        with self._lock:
+            entries = list(self.entries)
+        entries.reverse()
+        return entries[:limit] if limit else entries